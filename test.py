@@ -1,12 +1,10 @@
 import streamlit as st
 import pandas as pd
-import openpyxl
+import numpy as np
+import xlsxwriter
 import re
-from openpyxl.styles import Alignment, numbers
-from openpyxl.utils import get_column_letter
+import tempfile
 from io import BytesIO
-import base64
-from datetime import datetime
 
 # 设置页面配置
 st.set_page_config(
@@ -15,191 +13,175 @@ st.set_page_config(
     layout="wide"
 )
 
-def extract_conductor_type(product_name):
-    """根据产品名称判断导体类型。包含 "LV" 为铝导体，否则为铜导体。"""
-    if "LV" in product_name:
-        return "铝导体"
-    else:
-        return "铜导体"
-
-def extract_cross_section(product_name):
-    """从产品名称中提取横截面积。"""
-    try:
-        match = re.search(r'-\d+×(\d+)(?!\d)', product_name)
-        if match:
-            captured_group = match.group(1)
-            return int(captured_group)
-        return None
-    except Exception as e:
-        st.error(f"提取横截面积失败：{e}")
-        return None
-
-def create_or_load_workbook(filename):
-    """创建或加载 Excel 工作簿。如果文件不存在，则创建新文件。"""
-    try:
-        workbook = openpyxl.load_workbook(filename)
-    except FileNotFoundError:
-        workbook = openpyxl.Workbook()
-    return workbook
-
-def set_column_width(sheet):
-    """自动调整列宽以适应内容。"""
-    for column_cells in sheet.columns:
-        max_length = 0
-        for cell in column_cells:
-            try:
-                if cell.value:
-                    max_length = max(max_length, len(str(cell.value)))
-            except:
-                pass
+# 横截面积匹配，例如 "YJV-0.6/1kV-3×95+1×50" 中的 95
+_CROSS_RE = re.compile(r'-\d+×(\d+)(?!\d)')
+
+# 总订单中需要读取的列
+INPUT_COLUMNS = ["产品编码", "工单", "生产日期", "订单日期", "订单", "单位名称",
+                 "产品名称", "型号", "数量", "分排", "交期", "绝缘", "成缆", "外护"]
+
+# 输出表中日期列（生产日期、订单日期、交期、交期）的下标，普通表和错误表相同
+DATE_COLUMNS = (2, 3, 10, 14)
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# 所有单元格共用的居中格式，日期列另加 yyyy/mm/dd 数字格式
+CENTER_FORMAT = {'align': 'center', 'valign': 'vcenter'}
+DATE_FORMAT = {'num_format': 'yyyy/mm/dd', 'align': 'center', 'valign': 'vcenter'}
+
+def set_column_formats(sheet, headers, rows, column_formats):
+    """设置各列的单元格格式，并根据标题和数据自动调整列宽。必须在写入任何行之前调用，否则格式不会生效。"""
+    # 逐行累计每列的最大长度，标题长度作为初始值
+    col_max = [len(str(header)) if header else 0 for header in headers]
+    for row in rows:
+        for col_idx, value in enumerate(row):
+            if value is not None:
+                length = len(str(value))
+                if length > col_max[col_idx]:
+                    col_max[col_idx] = length
+    for col_idx, max_length in enumerate(col_max):
         adjusted_width = (max_length + 2)
-        sheet.column_dimensions[get_column_letter(column_cells[0].column)].width = adjusted_width
-
-def set_date_format(cell):
-    """设置单元格的日期格式为 yyyy/mm/dd。"""
-    cell.number_format = 'yyyy/mm/dd'
-
-def write_data_to_excel(workbook, sheet_name, data, headers):
-    """将数据写入 Excel 工作表，并处理日期格式。"""
-    if sheet_name in workbook.sheetnames:
-        sheet = workbook[sheet_name]
-    else:
-        sheet = workbook.create_sheet()
-        sheet.title = sheet_name
-        sheet.append(headers)
-        # 设置标题行样式
-        for cell in sheet[1]:
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-
-    for row in data:
-        sheet.append(row)
-        # 设置数据行样式
-        for cell in sheet[sheet.max_row]:
-            cell.alignment = Alignment(horizontal='center', vertical='center')
-        
-        # 处理日期格式
-        for col_idx, header in enumerate(headers):
-            if header in ["生产日期", "订单日期", "交期"]:
-                cell = sheet.cell(row=sheet.max_row, column=col_idx + 1)
-                if isinstance(cell.value, datetime):
-                    set_date_format(cell)
-    set_column_width(sheet)
-
-def save_workbook_to_buffer(workbook):
-    """将 Excel 工作簿保存到内存中的字节缓冲区。"""
-    buffer = BytesIO()
-    workbook.save(buffer)
-    buffer.seek(0)
-    return buffer
+        sheet.set_column(col_idx, col_idx, adjusted_width, column_formats[col_idx])
+
+def create_workbook(buffer, column_count, tmpdir):
+    """创建以常量内存模式写入 buffer 的 xlsxwriter 工作簿，行数据暂存在 tmpdir 目录中。
+
+    返回工作簿和前 column_count 列的单元格格式：日期列使用日期格式，其余列居中。
+    """
+    # in_memory 会关闭 constant_memory，因此直接写入 BytesIO，行数据由 tmpdir 中的临时文件暂存
+    workbook = xlsxwriter.Workbook(buffer, {'constant_memory': True, 'tmpdir': tmpdir,
+                                            'strings_to_urls': False})
+    center_format = workbook.add_format(CENTER_FORMAT)
+    date_format = workbook.add_format(DATE_FORMAT)
+    column_formats = [date_format if col_idx in DATE_COLUMNS else center_format
+                      for col_idx in range(column_count)]
+    return workbook, column_formats
+
+def write_sheet_bulk(workbook, sheet_name, rows, headers, column_formats,
+                     progress_callback=None, progress_step=1, rows_written=0):
+    """将同一工作表的全部数据按行流式写入 Excel，样式、日期格式和列宽通过列格式统一设置。
+
+    rows_written 为写入本表之前所有工作表已写入的行数。如果提供 progress_callback，
+    累计行数每到 progress_step 的整数倍调用一次，参数为累计已写入的行数。
+    """
+    sheet = workbook.add_worksheet(sheet_name)
+    set_column_formats(sheet, headers, rows, column_formats)
+    sheet.write_row(0, 0, headers)
+
+    # 未单独指定格式的单元格沿用所在列的格式
+    for row_count, row in enumerate(rows, start=1):
+        sheet.write_row(row_count, 0, row)
+
+        # 按所有工作表的累计行数节流，行数很少的工作表也不会让进度条停滞
+        total_written = rows_written + row_count
+        if progress_callback is not None and total_written % progress_step == 0:
+            progress_callback(total_written)
+
+def save_workbook_to_bytes(workbook, buffer):
+    """关闭 Excel 工作簿，并返回写入 buffer 的文件内容字节串。"""
+    workbook.close()
+    return buffer.getvalue()
 
 def process_excel_data(uploaded_file):
     try:
-        df = pd.read_excel(uploaded_file, sheet_name="总订单")
+        # 只读取用到的列；产品名称直接按字符串读取，省去后续的类型转换
+        df = pd.read_excel(uploaded_file, sheet_name="总订单", usecols=INPUT_COLUMNS,
+                           dtype={"产品名称": "string"})
         df.dropna(how='all', inplace=True)
 
         total_rows = len(df)
-        processed_count = 0
         errors = []
         
-        # 创建新的工作簿
-        aluminum_workbook = create_or_load_workbook("铝导体安排.xlsx")
-        copper_workbook = create_or_load_workbook("铜导体安排.xlsx")
-
-        # 删除默认的 Sheet 工作表
-        if 'Sheet' in aluminum_workbook.sheetnames:
-            del aluminum_workbook['Sheet']
-        if 'Sheet' in copper_workbook.sheetnames:
-            del copper_workbook['Sheet']
-
         headers = ["产品编码", "工单", "生产日期", "订单日期", "订单", "单位名称", 
                   "产品名称", "型号", "导体米数", "分排", "交期", "绝缘", "成缆", "外护", "交期"]
         
-        # 创建错误处理工作表
-        aluminum_error_sheet_name = "铝导体错误数据"
-        copper_error_sheet_name = "铜导体错误数据"
-        write_data_to_excel(aluminum_workbook, aluminum_error_sheet_name, [], headers + ["错误信息"])
-        write_data_to_excel(copper_workbook, copper_error_sheet_name, [], headers + ["错误信息"])
+        error_headers = headers + ["错误信息"]
+
+        # 以“是否铝导体”作为下标：0 为铜导体，1 为铝导体
+        error_sheet_names = ("铜导体错误数据", "铝导体错误数据")
+
+        # 按 (是否铝导体, 工作表名称) 收集 (标题, 数据行)，每个工作表只写入一次；
+        # 错误工作表先登记，保证它们始终存在且排在最前
+        buckets = {}
+        for wb_is_al in (True, False):
+            buckets[(wb_is_al, error_sheet_names[wb_is_al])] = (error_headers, [])
 
         progress_bar = st.progress(0)
         status_text = st.empty()
 
-        for index, row in df.iterrows():
-            try:
-                if pd.isna(row["产品名称"]):
-                    errors.append(f"第 {index + 2} 行：产品名称为空，无法处理。")
-                    # 将空产品名称的行写入错误工作表
-                    data_row = [
-                        row["产品编码"], row["工单"], row["生产日期"], row["订单日期"], 
-                        row["订单"], row["单位名称"], "", row["型号"], 
-                        row["数量"], row["分排"], row["交期"], row["绝缘"], 
-                        row["成缆"], row["外护"], row["交期"], "产品名称为空"
-                    ]
-                    conductor_type = extract_conductor_type(str(row["产品名称"]) if not pd.isna(row["产品名称"]) else "")
-                    if conductor_type == "铝导体":
-                        write_data_to_excel(aluminum_workbook, aluminum_error_sheet_name, [data_row], headers + ["错误信息"])
-                    elif conductor_type == "铜导体":
-                        write_data_to_excel(copper_workbook, copper_error_sheet_name, [data_row], headers + ["错误信息"])
-                    continue
-                
-                product_name = str(row["产品名称"])
-                conductor_type = extract_conductor_type(product_name)
-                cross_section = extract_cross_section(product_name)
-
-                if cross_section is None:
-                    errors.append(f"第 {index + 2} 行：无法提取横截面积，产品名称：{product_name}")
-                    # 将无法提取横截面积的行写入错误工作表
-                    data_row = [
-                        row["产品编码"], row["工单"], row["生产日期"], row["订单日期"], 
-                        row["订单"], row["单位名称"], product_name, row["型号"], 
-                        row["数量"], row["分排"], row["交期"], row["绝缘"], 
-                        row["成缆"], row["外护"], row["交期"], "无法提取横截面积"
-                    ]
-                    if conductor_type == "铝导体":
-                        write_data_to_excel(aluminum_workbook, aluminum_error_sheet_name, [data_row], headers + ["错误信息"])
-                    elif conductor_type == "铜导体":
-                        write_data_to_excel(copper_workbook, copper_error_sheet_name, [data_row], headers + ["错误信息"])
-                    continue
-
-                data_row = [
-                    row["产品编码"], row["工单"], row["生产日期"], row["订单日期"], 
-                    row["订单"], row["单位名称"], product_name, row["型号"], 
-                    row["数量"], row["分排"], row["交期"], row["绝缘"], 
-                    row["成缆"], row["外护"], row["交期"]
-                ]
-
-                # 确保工作表名称始终包含 "mm2" 后缀
-                sheet_name = f"{cross_section}mm2"
-                
-                if conductor_type == "铝导体":
-                    write_data_to_excel(aluminum_workbook, sheet_name, [data_row], headers)
-                elif conductor_type == "铜导体":
-                    write_data_to_excel(copper_workbook, sheet_name, [data_row], headers)
-                
-            except Exception as e:
-                errors.append(f"第 {index + 2} 行：处理失败，原因：{str(e)}，产品名称：{product_name}")
-                # 将其他错误写入错误工作表
-                data_row = [
-                    row["产品编码"], row["工单"], row["生产日期"], row["订单日期"], 
-                    row["订单"], row["单位名称"], product_name if not pd.isna(product_name) else "", row["型号"], 
-                    row["数量"], row["分排"], row["交期"], row["绝缘"], 
-                    row["成缆"], row["外护"], row["交期"], f"处理失败：{str(e)}"
-                ]
-                conductor_type = extract_conductor_type(str(row["产品名称"]) if not pd.isna(row["产品名称"]) else "")
-                if conductor_type == "铝导体":
-                    write_data_to_excel(aluminum_workbook, aluminum_error_sheet_name, [data_row], headers + ["错误信息"])
-                elif conductor_type == "铜导体":
-                   write_data_to_excel(copper_workbook, copper_error_sheet_name, [data_row], headers + ["错误信息"])
-            
-            processed_count += 1
+        # 向量化计算每行的导体类型、横截面积、错误原因和目标工作表，避免逐行判断
+        names = df["产品名称"]
+        is_al = names.str.contains("LV", na=False).to_numpy()
+        cross_section_digits = names.str.extract(_CROSS_RE, expand=False)
+        cross_sections = pd.to_numeric(cross_section_digits, errors="coerce")
+        reasons = np.where(names.isna(), "产品名称为空",
+                           np.where(cross_sections.isna(), "无法提取横截面积", ""))
+        is_error = reasons != ""
+        # 工作表名称直接取匹配到的数字串并去掉前导零（与 int() 结果一致，且不受整数位数限制），
+        # 确保工作表名称始终包含 "mm2" 后缀
+        sheet_names = np.where(is_error,
+                               np.where(is_al, error_sheet_names[True], error_sheet_names[False]),
+                               cross_section_digits.str.replace(r'^0+(?=\d)', '', regex=True) + "mm2")
+
+        for index, product_name, reason in zip(df.index[is_error], names[is_error], reasons[is_error]):
+            if reason == "产品名称为空":
+                errors.append(f"第 {index + 2} 行：产品名称为空，无法处理。")
+            else:
+                errors.append(f"第 {index + 2} 行：无法提取横截面积，产品名称：{product_name}")
+        processed_count = int((~is_error).sum())
+
+        output = df[INPUT_COLUMNS].copy()
+        output["产品名称"] = names.fillna("").astype(object)
+        # 表尾的第二个交期列直接复用已取出的交期数据，不再重复查找
+        output["重复交期"] = output["交期"]
+        output["错误信息"] = reasons
+
+        # 按输出列顺序一次性转换为二维数组，各组直接按行位置取数据
+        output_values = output.to_numpy(dtype=object)
+        # 空值（NaN、NaT）统一写为空单元格
+        output_values[pd.isna(output_values)] = None
+        row_positions = pd.Series(np.arange(len(output_values)))
+
+        # 按 (是否铝导体, 工作表名称) 分组，每组一次性写入对应工作表
+        for (group_is_al, sheet_name), positions in row_positions.groupby([is_al, sheet_names], sort=False):
+            group_values = output_values[positions.to_numpy()]
+            if sheet_name in error_sheet_names:
+                buckets[(bool(group_is_al), sheet_name)] = (error_headers, group_values.tolist())
+            else:
+                # 正常数据不需要最后的错误信息列
+                buckets[(bool(group_is_al), sheet_name)] = (headers, group_values[:, :-1].tolist())
+
+        # 进度条最多刷新约 100 次，避免每行都与前端通信
+        progress_step = max(1, total_rows // 100)
+        written_rows = 0
+
+        def update_progress(total_written):
             # 确保进度值在 0 到 1 之间
-            progress = min((index + 1) / total_rows, 1.0)
+            progress = min(total_written / total_rows, 1.0) if total_rows else 1.0
             progress_bar.progress(progress)
             status_text.text(f'处理进度: {int(progress * 100)}%')
 
-        aluminum_buffer = save_workbook_to_buffer(aluminum_workbook)
-        copper_buffer = save_workbook_to_buffer(copper_workbook)
-
-        return processed_count, errors, aluminum_buffer, copper_buffer
+        # 行数据暂存在临时目录中，离开 with 块时（包括出错或页面被中断）连同其中的文件一起删除，
+        # 不会在临时目录里留下订单数据
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # 分组完成后再创建工作簿，文件内容写入内存缓冲区
+            aluminum_buffer = BytesIO()
+            copper_buffer = BytesIO()
+            aluminum_workbook, aluminum_formats = create_workbook(aluminum_buffer, len(error_headers), tmpdir)
+            copper_workbook, copper_formats = create_workbook(copper_buffer, len(error_headers), tmpdir)
+            workbooks = (copper_workbook, aluminum_workbook)
+            column_formats = (copper_formats, aluminum_formats)
+
+            for (wb_is_al, sheet_name), (sheet_headers, data_rows) in buckets.items():
+                write_sheet_bulk(workbooks[wb_is_al], sheet_name, data_rows, sheet_headers,
+                                 column_formats[wb_is_al], update_progress, progress_step, written_rows)
+                written_rows += len(data_rows)
+            update_progress(written_rows)
+
+            aluminum_bytes = save_workbook_to_bytes(aluminum_workbook, aluminum_buffer)
+            copper_bytes = save_workbook_to_bytes(copper_workbook, copper_buffer)
+
+        return processed_count, errors, aluminum_bytes, copper_bytes
     except Exception as e:
         return 0, [f"文件处理失败，原因：{str(e)}"], None, None
 
@@ -211,7 +193,7 @@ def main():
     if uploaded_file is not None:
         if st.button("开始处理"):
             with st.spinner("正在处理数据..."):
-                processed_count, errors, aluminum_buffer, copper_buffer = process_excel_data(uploaded_file)
+                processed_count, errors, aluminum_bytes, copper_bytes = process_excel_data(uploaded_file)
             
             if errors:
                 st.error("处理过程中出现以下错误：")
@@ -221,17 +203,26 @@ def main():
             st.success(f"成功处理 {processed_count} 条记录！")
             st.success("数据分类完成！")
                 
+            # 下载按钮使用 on_click="ignore"，点击后不会重新运行页面，另一个下载按钮仍然保留
             col1, col2 = st.columns(2)
             with col1:
-                if aluminum_buffer:
-                    b64_al = base64.b64encode(aluminum_buffer.read()).decode()
-                    href_al = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64_al}" download="铝导体安排.xlsx">下载铝导体安排.xlsx</a>'
-                    st.markdown(href_al, unsafe_allow_html=True)
+                if aluminum_bytes:
+                    st.download_button(
+                        "下载铝导体安排.xlsx",
+                        data=aluminum_bytes,
+                        file_name="铝导体安排.xlsx",
+                        mime=XLSX_MIME,
+                        on_click="ignore"
+                    )
             with col2:
-                if copper_buffer:
-                    b64_co = base64.b64encode(copper_buffer.read()).decode()
-                    href_co = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64_co}" download="铜导体安排.xlsx">下载铜导体安排.xlsx</a>'
-                    st.markdown(href_co, unsafe_allow_html=True)
+                if copper_bytes:
+                    st.download_button(
+                        "下载铜导体安排.xlsx",
+                        data=copper_bytes,
+                        file_name="铜导体安排.xlsx",
+                        mime=XLSX_MIME,
+                        on_click="ignore"
+                    )
 
 if __name__ == "__main__":
     main()